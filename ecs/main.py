@@ -21,6 +21,7 @@ from am.utils import clean_dir, load_model, time_it
 
 local_inputs_dir = Path('/tmp/inputs')
 local_outputs_dir = Path('/tmp/outputs')
+max_empty_poll_n = 2
 
 logger = logging.getLogger('am-segm')
 
@@ -33,7 +34,7 @@ def create_model():
     if fname.endswith('.tar.gz'):
         with tarfile.open(fname, 'r:gz') as f:
             f.extractall()
-    return load_model('model.pt')
+    return load_model('model.pt', warmup_batch_size=INFERENCE_BATCH_SIZE)
 
 
 @time_it
@@ -43,13 +44,18 @@ def run_inference():
         model = create_model()
 
         total_n = 0
+        empty_poll_n = 0
         while True:
             s3_paths, receipt_handles = consume_messages(
                 queue_url=os.environ['QUEUE_URL'], n=INFERENCE_BATCH_SIZE
             )
             if not s3_paths:
-                logger.info('No more messages in the queue. Exiting')
-                break
+                empty_poll_n += 1
+                if empty_poll_n >= max_empty_poll_n:
+                    logger.info('No more messages in the queue. Exiting')
+                    break
+                continue
+            empty_poll_n = 0
             total_n += len(s3_paths)
 
             local_input_paths = [local_inputs_dir / s3_path for s3_path in s3_paths]
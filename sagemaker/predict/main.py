@@ -11,6 +11,7 @@ import segmentation_models_pytorch as smp
 from albumentations.pytorch.functional import img_to_tensor
 
 from am.segm.dataset import valid_transform
+from am.utils import load_state_dict
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -25,8 +26,7 @@ def model_fn(model_dir):
         logger.info("Gpu count: {}".format(torch.cuda.device_count()))
         model = nn.DataParallel(model)
 
-    with open(os.path.join(model_dir, 'unet.pt'), 'rb') as f:
-        model.load_state_dict(torch.load(f, map_location=device))
+    load_state_dict(model, os.path.join(model_dir, 'unet.pt'), device)
     model.eval()
     return model.to(device)
 
@@ -56,9 +56,9 @@ def predict_fn(inputs, model):
 
     with torch.no_grad():
         outputs = model(inputs.to(device))
-        probs = torch.sigmoid(outputs).squeeze(dim=1).detach().cpu().numpy()
-        masks = (probs > 0.5).astype(int)
-        return masks
+        probs = torch.sigmoid(outputs).squeeze(dim=1)
+        masks = (probs > 0.5).to(torch.uint8)
+        return masks.cpu().numpy()
 
 
 def output_fn(prediction, content_type):
@@ -19,7 +19,7 @@ from am.ecs import (
     download_images_from_s3,
     INFERENCE_BATCH_SIZE,
     remove_images_from_s3,
-    list_images_on_s3,
+    iter_images_on_s3,
 )
 from am.config import Config
 
@@ -47,9 +47,9 @@ def upload_to_s3(input_path, groups, prefix):
 @time_it
 def run_inference(s3_paths, prefix):
     def stop_callback():
-        pred_s3_paths = list_images_on_s3(config['output_bucket'], prefix)
-        logger.debug(f'Predicted {len(pred_s3_paths)}/{len(s3_paths)} images')
-        return len(pred_s3_paths) == len(s3_paths)
+        pred_n = sum(1 for _ in iter_images_on_s3(config['output_bucket'], prefix))
+        logger.debug(f'Predicted {pred_n}/{len(s3_paths)} images')
+        return pred_n == len(s3_paths)
 
     ecs = boto3.client('ecs')
     ecs_max_task_n = 10
@@ -66,11 +66,12 @@ def run_inference(s3_paths, prefix):
         if task_n > 0:
             sleep(5)
 
-    sleep_interval = 10
+    sleep_interval = 5
+    max_sleep_interval = 30
     timeout = 5 * 60
     finish = time() + timeout
     while time() < finish:
-        logger.debug(f'Waiting for {sleep_interval}s')
+        logger.debug(f'Waiting for {sleep_interval:.0f}s')
         sleep(sleep_interval)
         resp = ecs.describe_tasks(cluster='am-segm', tasks=task_arns)
         task_statuses = [t['lastStatus'] for t in resp['tasks']]
@@ -78,6 +79,9 @@ def run_inference(s3_paths, prefix):
 
         if stop_callback():
             break
+        if all(status == 'STOPPED' for status in task_statuses):
+            raise Exception('All tasks stopped before all images were predicted')
+        sleep_interval = min(sleep_interval * 1.5, max_sleep_interval)
     else:
         raise Exception(f'Timeout: {timeout}s')
 
@@ -2,44 +2,63 @@ import logging
 from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config as BotoConfig
+import cv2
+import numpy as np
 import torch
-from albumentations.pytorch.functional import img_to_tensor
-from albumentations import Compose, Normalize, Resize
 from torch.utils.data import Dataset
 
 from am.segment.image_utils import read_image, save_image
+from am.utils import autocast
 
 logger = logging.getLogger('am-segm')
 
 INFERENCE_BATCH_SIZE = 8
 
+s3 = boto3.client('s3', config=BotoConfig(max_pool_connections=64, retries={'max_attempts': 3}))
+transfer_mgr = create_transfer_manager(s3, TransferConfig(max_concurrency=32, use_threads=True))
+
 
 def upload_images_to_s3(local_paths, bucket, s3_paths, queue_url=None):
     logger.info(f'Uploading {len(local_paths)} files to s3://{bucket}')
-    s3 = boto3.client('s3')
-    sqs = boto3.client('sqs')
-
-    def upload(args):
-        local_path, s3_path = args
+    futures = []
+    for local_path, s3_path in zip(local_paths, s3_paths):
         logger.debug(f'Uploading {local_path} to s3://{bucket}/{s3_path}')
-        s3.upload_file(str(local_path), bucket, s3_path)
-
-        if queue_url:
-            logger.debug(f'Sending message to queue: {s3_path}')
-            sqs.send_message(QueueUrl=queue_url, MessageBody=s3_path)
-
-    with ThreadPoolExecutor() as executor:
-        list(executor.map(upload, zip(local_paths, s3_paths)))
-
-
-def consume_messages(queue_url, n=8):
+        futures.append(transfer_mgr.upload(str(local_path), bucket, s3_path))
+    for future in futures:
+        future.result()
+
+    if queue_url:
+        sqs = boto3.client('sqs')
+        for i in range(0, len(s3_paths), 10):
+            entries = [
+                {'Id': str(j), 'MessageBody': s3_path}
+                for j, s3_path in enumerate(s3_paths[i:i + 10])
+            ]
+            logger.debug(f'Sending {len(entries)} messages to queue')
+            resp = sqs.send_message_batch(QueueUrl=queue_url, Entries=entries)
+            if resp.get('Failed'):
+                raise Exception(f'Failed to send messages: {resp["Failed"]}')
+
+
+def consume_messages(queue_url, n=8, wait_time=20, visibility_timeout=300):
     sqs = boto3.client('sqs')
     receipt_handles = []
     input_paths = []
-    for i in range(n):
-        resp = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=1)
-        logger.debug(f"Round: {i}, messages: {len(resp.get('Messages', []))}")
-        for message in resp.get('Messages', []):
+    while len(input_paths) < n:
+        resp = sqs.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=min(10, n - len(input_paths)),
+            # long-poll only for the first messages, top up without waiting
+            WaitTimeSeconds=0 if input_paths else wait_time,
+            VisibilityTimeout=visibility_timeout,
+        )
+        messages = resp.get('Messages', [])
+        logger.debug(f'Received messages: {len(messages)}')
+        if not messages:
+            break
+        for message in messages:
             input_paths.append(message['Body'])
             receipt_handles.append(message['ReceiptHandle'])
 
@@ -48,17 +67,14 @@ def consume_messages(queue_url, n=8):
 
 def download_images_from_s3(bucket, s3_paths, local_paths):
     logger.info(f'Downloading {len(s3_paths)} files from s3://{bucket}')
-    s3 = boto3.client('s3')
-
-    def download(args):
-        s3_path, local_path = args
+    futures = []
+    for s3_path, local_path in zip(s3_paths, local_paths):
         if not local_path.parent.exists():
             local_path.parent.mkdir(parents=True, exist_ok=True)
         logger.debug(f'Downloading {s3_path} to {local_path}')
-        s3.download_file(bucket, str(s3_path), str(local_path))
-
-    with ThreadPoolExecutor() as executor:
-        list(executor.map(download, zip(s3_paths, local_paths)))
+        futures.append(transfer_mgr.download(bucket, str(s3_path), str(local_path)))
+    for future in futures:
+        future.result()
 
 
 def remove_images_from_s3(bucket, prefix):
@@ -68,62 +84,90 @@ def remove_images_from_s3(bucket, prefix):
 
 class AMDataset(Dataset):
 
-    def __init__(self, image_paths):
+    def __init__(self, image_paths, size=512):
         self._image_paths = image_paths
-        self._transform = Compose([Normalize(), Resize(512, 512)])
+        self._size = size
+        # ImageNet statistics, same as albumentations.Normalize defaults
+        self._mean = np.array([0.485, 0.456, 0.406], dtype=np.float32) * 255
+        self._std = np.array([0.229, 0.224, 0.225], dtype=np.float32) * 255
 
     def __len__(self):
         return len(self._image_paths)
 
     def __getitem__(self, idx):
         image_path = self._image_paths[idx]
-        image = read_image(image_path, ch_n=3)
-        image = self._transform(image=image)['image']
-        return img_to_tensor(image)
+        image = read_image(image_path, ch_n=3).astype(np.float32)
+        image -= self._mean
+        image /= self._std
+        if image.shape[:2] != (self._size, self._size):
+            image = cv2.resize(image, (self._size, self._size), interpolation=cv2.INTER_LINEAR)
+        return torch.from_numpy(image.transpose(2, 0, 1))
 
 
 def predict(model, image_paths):
     logger.info(f'Predicting {len(image_paths)} paths')
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    ds = AMDataset(image_paths)
+    # cv2 releases the GIL while decoding, so threads read tiles in parallel
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(ds)))) as executor:
+        tiles = list(executor.map(ds.__getitem__, range(len(ds))))
+
+    masks_list = []
     with torch.no_grad():
-        ds = AMDataset(image_paths)
-        inputs = torch.stack([t for t in ds])
-        inputs = inputs.to(device)
-        probs = torch.sigmoid(model(inputs))
-        probs = probs.squeeze(dim=1).detach().cpu().numpy()
-        masks = (probs > 0.5).astype(int)
-        return masks
+        for i in range(0, len(tiles), INFERENCE_BATCH_SIZE):
+            inputs = torch.stack(tiles[i:i + INFERENCE_BATCH_SIZE])
+            batch_n = inputs.shape[0]
+            if device.type == 'cuda':
+                # pad to a fixed shape so the compiled model's CUDA graph is reused
+                pad = inputs.new_zeros((INFERENCE_BATCH_SIZE - batch_n,) + inputs.shape[1:])
+                inputs = torch.cat([inputs, pad])
+                # NHWC layout lets cuDNN pick its channels_last conv kernels
+                inputs = inputs.pin_memory().to(
+                    device, memory_format=torch.channels_last, non_blocking=True
+                )
+            with autocast():
+                outputs = model(inputs)[:batch_n]
+            probs = torch.sigmoid(outputs.float()).squeeze(dim=1)
+            masks = (probs > 0.5).to(torch.uint8)
+            masks_list.append(masks.cpu().numpy())
+    return np.concatenate(masks_list, axis=0)
 
 
 def save_predictions(predictions, output_paths):
     logger.info(f'Saving {len(predictions)} predictions')
-    for pred, output_path in zip(predictions, output_paths):
-        if not output_path.parent.exists():
-            output_path.parent.mkdir(parents=True)
-        image = pred * 255
+    for parent in {output_path.parent for output_path in output_paths}:
+        parent.mkdir(parents=True, exist_ok=True)
+
+    def save(args):
+        pred, output_path = args
+        image = pred.astype(np.uint8) * 255
         logger.debug(f'Saving prediction: {image.shape} to {output_path}')
-        save_image(image, output_path)
+        save_image(image, output_path, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(save, zip(predictions, output_paths)))
 
 
 def delete_messages(queue_url, receipt_handles):
     logger.info(f'Deleting {len(receipt_handles)} messages from {queue_url}')
     sqs = boto3.client('sqs')
-    for handle in receipt_handles:
-        sqs.delete_message(QueueUrl=queue_url,
-                           ReceiptHandle=handle)
+    for i in range(0, len(receipt_handles), 10):
+        entries = [
+            {'Id': str(j), 'ReceiptHandle': handle}
+            for j, handle in enumerate(receipt_handles[i:i + 10])
+        ]
+        resp = sqs.delete_message_batch(QueueUrl=queue_url, Entries=entries)
+        for failed in resp.get('Failed', []):
+            logger.warning(f'Failed to delete message: {failed}')
+
+
+def iter_images_on_s3(bucket, prefix):
+    paginator = s3.get_paginator('list_objects_v2')
+    pages = paginator.paginate(Bucket=bucket, Prefix=prefix, PaginationConfig={'PageSize': 1000})
+    for page in pages:
+        for doc in page.get('Contents', []):
+            yield doc['Key']
 
 
 def list_images_on_s3(bucket, prefix):
-    s3 = boto3.client('s3')
-    keys = []
-    kwargs = dict(Bucket=bucket, Prefix=prefix)
-    while True:
-        resp = s3.list_objects_v2(**kwargs)
-        for doc in resp.get('Contents', []):
-            keys.append(doc['Key'])
-
-        if resp.get('IsTruncated', False):
-            kwargs['ContinuationToken'] = resp['NextContinuationToken']
-        else:
-            break
-    return keys
+    return list(iter_images_on_s3(bucket, prefix))
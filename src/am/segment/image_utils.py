@@ -4,7 +4,6 @@ from pathlib import Path
 
 import cv2
 import numpy as np
-from PIL import Image
 from albumentations import PadIfNeeded
 
 logger = logging.getLogger('am-segm')
@@ -35,6 +34,12 @@ def pad_image(image, target_shape):
     return padded_image
 
 
+def center_crop(image, target_shape):
+    h, w = target_shape
+    y0, x0 = (image.shape[0] - h) // 2, (image.shape[1] - w) // 2
+    return image[y0:y0 + h, x0:x0 + w]
+
+
 def pad_slice_image(image, tile_size, target_size):
     padded_image = pad_image(image, target_size)
     tiles = slice_image(padded_image, tile_size)
@@ -48,21 +53,30 @@ def overlay_source_mask(source: np.ndarray, mask: np.ndarray, alpha: float = 0.3
         new_shape = mask.shape
     new_size = (new_shape[1], new_shape[0])
 
-    mask_3ch = np.array(Image.fromarray(mask).convert('RGB'))
+    if mask.ndim == 3:
+        mask = mask[:, :, 0]
+    mask_3ch = cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB)
     mask_3ch[mask > 127] = [255, 0, 0]  # make ablation marks red
-    overlay = Image.blend(
-        Image.fromarray(source).resize(new_size).convert('RGB'),
-        Image.fromarray(mask_3ch).resize(new_size),
-        alpha
+    if source.ndim == 2:
+        source = cv2.cvtColor(source, cv2.COLOR_GRAY2RGB)
+    overlay = cv2.addWeighted(
+        cv2.resize(source, new_size, interpolation=cv2.INTER_NEAREST), 1 - alpha,
+        cv2.resize(mask_3ch, new_size, interpolation=cv2.INTER_NEAREST), alpha,
+        0.0
     )
-    return np.array(overlay)
+    return overlay
 
 
 def read_image(path: Path, ch_n: int = None) -> np.ndarray:
     if not Path(path).exists():
         raise Exception(f'Image file not found: {path}')
 
-    img = cv2.imread(str(path))
+    if ch_n == 1:
+        return cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+
+    img = cv2.imread(str(path), cv2.IMREAD_ANYCOLOR)  # grayscale files are decoded as one channel
+    if img.ndim == 2:
+        return img if ch_n is None else cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
     if ch_n is None:
@@ -80,11 +94,12 @@ def save_rgb_image(array, path):
     save_image(array, path)
 
 
-def save_image(array: np.ndarray, path: Path):
+def save_image(array: np.ndarray, path: Path, params: list = None):
+    params = params or []
     if array.ndim == 3:
-        res = cv2.imwrite(str(path), cv2.cvtColor(array, cv2.COLOR_RGB2BGR))
+        res = cv2.imwrite(str(path), cv2.cvtColor(array, cv2.COLOR_RGB2BGR), params)
     else:
-        res = cv2.imwrite(str(path), array)
+        res = cv2.imwrite(str(path), array, params)
     assert res, f'Failed to save {path}'
 
 
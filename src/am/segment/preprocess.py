@@ -2,13 +2,13 @@ import itertools
 import logging
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import cv2
-from albumentations import CenterCrop
 
 from am.segment.image_utils import pad_slice_image, compute_tile_row_col_n, clip, \
-    normalize, overlay_source_mask, save_rgb_image, read_image, save_image
+    normalize, overlay_source_mask, read_image, save_image, center_crop
 
 logger = logging.getLogger('am-segm')
 
@@ -65,22 +65,24 @@ def slice_to_tiles(input_group_path, output_group_path, tile_size=512):
     meta['tile'] = {'rows': tile_row_n, 'cols': tile_col_n, 'size': tile_size}
     json.dump(meta, open(output_group_path / 'meta.json', 'w'))
 
-    for i, tile in enumerate(tiles):
+    def save_tile(args):
+        i, tile = args
         tile_path = image_tiles_path / f'{i:04}.png'
         logger.debug(f'Save tile: {tile_path}')
-        save_image(tile, tile_path)
+        save_image(tile, tile_path, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(save_tile, enumerate(tiles)))
 
 
 def stitch_tiles(tiles, tile_size, tile_row_n, tile_col_n):
-    rows = tile_size * tile_row_n
-    cols = tile_size * tile_col_n
-    ch_n = tiles[0].shape[-1] if tiles[0].ndim == 3 else None
-    image = np.zeros((rows, cols, ch_n) if ch_n else (rows, cols), dtype=np.uint8)
-    for i in range(tile_row_n):
-        for j in range(tile_col_n):
-            tile = tiles[i * tile_col_n + j]
-            image[i*tile_size:(i+1)*tile_size, j*tile_size:(j+1)*tile_size] = tile
-    return image
+    tiles = np.stack(tiles[:tile_row_n * tile_col_n]).astype(np.uint8, copy=False)
+    ch_n = tiles.shape[-1] if tiles.ndim == 4 else None
+    tiles = tiles.reshape(tile_row_n, tile_col_n, tile_size, tile_size, ch_n or 1)
+    image = tiles.transpose(0, 2, 1, 3, 4).reshape(
+        tile_row_n * tile_size, tile_col_n * tile_size, ch_n or 1
+    )
+    return image if ch_n else image[:, :, 0]
 
 
 def stitch_and_crop_tiles(tiles_path, tile_size, meta):
@@ -88,14 +90,19 @@ def stitch_and_crop_tiles(tiles_path, tile_size, meta):
     if len(tile_paths) != meta['tile']['rows'] * meta['tile']['cols']:
         logger.warning(f'Number of tiles does not match meta: {len(tile_paths)}, {meta}')
 
-    tiles = [None] * len(tile_paths)
-    for path in tile_paths:
-        i = int(path.stem)
+    def read_tile(path):
         tile = read_image(path)
-        tiles[i] = cv2.resize(tile, (tile_size, tile_size), interpolation=cv2.INTER_NEAREST)
+        if tile.shape[:2] != (tile_size, tile_size):
+            tile = cv2.resize(tile, (tile_size, tile_size), interpolation=cv2.INTER_NEAREST)
+        return int(path.stem), tile
+
+    tiles = [None] * len(tile_paths)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for i, tile in executor.map(read_tile, tile_paths):
+            tiles[i] = tile
 
     stitched_image = stitch_tiles(tiles, tile_size, meta['tile']['rows'], meta['tile']['cols'])
-    stitched_image = CenterCrop(meta['image']['h'], meta['image']['w']).apply(stitched_image)
+    stitched_image = center_crop(stitched_image, (meta['image']['h'], meta['image']['w']))
     return stitched_image
 
 
@@ -121,4 +128,4 @@ def overlay_images_with_masks(input_group_path, image_ext='png'):
     mask = read_image(input_group_path / f'mask.{image_ext}')
     assert source.shape[:2] == mask.shape[:2]
     overlay = overlay_source_mask(source, mask)
-    save_rgb_image(np.array(overlay), input_group_path / f'overlay.{image_ext}')
+    save_image(overlay, input_group_path / f'overlay.{image_ext}', [cv2.IMWRITE_PNG_COMPRESSION, 1])
@@ -1,6 +1,8 @@
 import logging
 import tarfile
+import zipfile
 from collections import namedtuple
+from contextlib import nullcontext
 from functools import wraps
 from pathlib import Path
 from shutil import rmtree
@@ -48,7 +50,35 @@ def save_model(model, model_path):
     torch.save(model.state_dict(), model_path)
 
 
-def load_model(model_path):
+def torch_version():
+    return tuple(int(v) for v in torch.__version__.split('+')[0].split('.')[:2])
+
+
+def autocast():
+    # mixed precision is only available on GPU with torch>=1.6
+    if not torch.cuda.is_available():
+        return nullcontext()
+    if hasattr(torch, 'autocast'):
+        return torch.autocast('cuda')
+    if hasattr(torch.cuda, 'amp'):
+        return torch.cuda.amp.autocast()
+    return nullcontext()
+
+
+def load_state_dict(model, model_path, device):
+    # only zipfile checkpoints (torch>=1.6 default) can be memory-mapped
+    if torch_version() >= (2, 1) and zipfile.is_zipfile(model_path):
+        # memory-map weights instead of reading the whole file into host RAM
+        state_dict = torch.load(
+            str(model_path), map_location=device, mmap=True, weights_only=True
+        )
+        model.load_state_dict(state_dict, assign=True)
+    else:
+        with open(model_path, 'rb') as f:
+            model.load_state_dict(torch.load(f, map_location=device))
+
+
+def load_model(model_path, warmup_batch_size=None):
     logger.info(f'Loading model from "{model_path}"')
 
     device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
@@ -59,10 +89,21 @@ def load_model(model_path):
         logger.info("Gpu count: {}".format(torch.cuda.device_count()))
         model = nn.DataParallel(model)
 
-    with open(model_path, 'rb') as f:
-        model.load_state_dict(torch.load(f, map_location=device))
+    load_state_dict(model, model_path, device)
     model.eval()
-    return model.to(device)
+    model = model.to(device)
+    if device.type == 'cuda':
+        model = model.to(memory_format=torch.channels_last)
+
+    if device.type == 'cuda' and torch_version() >= (2, 0):
+        logger.info('Compiling model')
+        model = torch.compile(model, mode='reduce-overhead', fullgraph=False)
+        if warmup_batch_size:
+            # trigger compilation before the first real batch
+            inputs = torch.zeros(warmup_batch_size, 3, 512, 512, device=device)
+            with torch.no_grad(), autocast():
+                model(inputs.to(memory_format=torch.channels_last))
+    return model
 
 
 def find_all_groups(data_path):
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from am.segment.preprocess import stitch_tiles
+
+
+def stitch_tiles_loop(tiles, tile_size, tile_row_n, tile_col_n):
+    rows = tile_size * tile_row_n
+    cols = tile_size * tile_col_n
+    ch_n = tiles[0].shape[-1] if tiles[0].ndim == 3 else None
+    image = np.zeros((rows, cols, ch_n) if ch_n else (rows, cols), dtype=np.uint8)
+    for i in range(tile_row_n):
+        for j in range(tile_col_n):
+            tile = tiles[i * tile_col_n + j]
+            image[i*tile_size:(i+1)*tile_size, j*tile_size:(j+1)*tile_size] = tile
+    return image
+
+
+@pytest.mark.parametrize('tile_shape', [(4, 4), (4, 4, 3)])
+@pytest.mark.parametrize('tile_row_n, tile_col_n', [(1, 1), (2, 3), (3, 2)])
+def test_stitch_tiles(tile_shape, tile_row_n, tile_col_n):
+    rng = np.random.RandomState(0)
+    tiles = [
+        rng.randint(0, 256, size=tile_shape).astype(np.uint8)
+        for _ in range(tile_row_n * tile_col_n)
+    ]
+
+    image = stitch_tiles(tiles, tile_shape[0], tile_row_n, tile_col_n)
+
+    expected = stitch_tiles_loop(tiles, tile_shape[0], tile_row_n, tile_col_n)
+    assert image.shape == expected.shape
+    assert image.dtype == np.uint8
+    np.testing.assert_array_equal(image, expected)